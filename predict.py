@@ -77,12 +77,17 @@ if __name__ == "__main__":
     parser.add_argument("--device", type=str, default=None)
     parser.add_argument("--batch_size", type=int, required=True)
     parser.add_argument("--iteration_count", type=int, default=5)
+    parser.add_argument("--bucket_size", type=int, default=32, help="num of length-sorted sents per forward pass")
     parser.add_argument("--min_seq_len", type=int, default=3, help="<= min_seq_len will be skipped")
     parser.add_argument("--max_num_tokens", type=int, default=128, help="max seq length after tokenization")
     parser.add_argument("--min_error_probability", type=float, default=0.0)
     parser.add_argument("--additional_confidence", type=float, default=0.0)
     parser.add_argument("--sub_token_mode", type=str, default="average")
+    parser.add_argument("--amp_dtype", type=str, default="bf16", choices=["fp32", "fp16", "bf16"],
+                        help="dtype of the model weights and of autocast in the forward, fp32 disables autocast")
     parser.add_argument("--max_pieces_per_token", type=int, default=5)
+    parser.add_argument("--kernel_inject", type=int, default=1, help="use deepspeed fused inference kernels")
+    parser.add_argument("--cuda_graph", type=int, default=0, help="capture the model forward into cuda graphs, batch size and seq len are padded to the next power of 2")
     parser.add_argument("--unk2keep", type=int, default=0, help="replace oov label with keep")
     parser.add_argument("--ckpt_path", type=str, required=True)
     parser.add_argument("--detect_vocab_path", type=str, required=True)
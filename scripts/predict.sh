@@ -14,7 +14,7 @@ deepspeed --include localhost:0 --master_port 42991 predict.py \
     --sub_token_mode "average" \
     --max_pieces_per_token 5 \
     --ckpt_path $ckpt_path \
-    --deepspeed_config "./configs/ds_config_zero1_fp16.json" \
+    --amp_dtype "fp16" \
     --detect_vocab_path "./data/vocabulary/d_tags.txt" \
     --correct_vocab_path "./data/vocabulary/labels.txt" \
     --pretrained_transformer_path $pretrained_transformer_path \
@@ -1,5 +1,6 @@
 # -*- coding:UTF-8 -*-
 from numpy import isin
+import numpy as np
 from torch.utils.data import Dataset
 from utils.helpers import INCORRECT_LABEL, SEQ_DELIMETERS, START_TOKEN, KEEP_LABEL, PAD_LABEL, UNK_LABEL, CORRECT_LABEL
 from random import random
@@ -164,8 +165,10 @@ class Seq2EditDataset(Dataset):
 
 
 class MyCollate:
-    def __init__(self, max_len, input_pad_id, detect_pad_id, correct_pad_id):
+    def __init__(self, max_len, input_pad_id, detect_pad_id, correct_pad_id, pad_to_longest=False):
         self.max_len = max_len
+        # if True, pad to the longest instance in the batch instead of max_len
+        self.pad_to_longest = pad_to_longest
         self.input_pad_id = input_pad_id
         self.detect_pad_id = detect_pad_id
         self.correct_pad_id = correct_pad_id
@@ -199,9 +202,15 @@ class MyCollate:
         return instance
 
     def __call__(self, batch):
+        max_len = self.max_len
+        if self.pad_to_longest:
+            max_len = max(len(item["input_ids"]) for item in batch)
+
+        if isinstance(batch[0]["input_ids"], np.ndarray):
+            return self.collate_arrays(batch, max_len)
 
         for item in batch:
-            item = self.pad_instance(item, self.max_len)
+            item = self.pad_instance(item, max_len)
 
         keys = item.keys()
 
@@ -211,3 +220,19 @@ class MyCollate:
                                 for item in batch], dtype=torch.long)
             batch_dict[key] = value
         return batch_dict
+
+    def collate_arrays(self, batch, max_len):
+        """
+        collate instances built from numpy arrays by filling one padded array per key
+        """
+        pad_values = {"input_ids": self.input_pad_id,
+                      "detect_tag_ids": self.detect_pad_id,
+                      "correct_tag_ids": self.correct_pad_id}
+        batch_dict = dict()
+        for key, value in batch[0].items():
+            padded = np.full((len(batch), max_len) + value.shape[1:],
+                             pad_values.get(key, 0), dtype=np.int64)
+            for i, item in enumerate(batch):
+                padded[i, :len(item[key])] = item[key]
+            batch_dict[key] = torch.from_numpy(padded)
+        return batch_dict
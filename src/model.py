@@ -9,11 +9,12 @@ import os
 
 
 class SeqEncoder(nn.Module):
-    def __init__(self, sub_token_mode, encoder_path, device):
+    def __init__(self, sub_token_mode, encoder_path, device, max_span_width=None):
         super().__init__()
         self.matched_embedder = AutoModel.from_pretrained(encoder_path)
         self.hidden_size = self.matched_embedder.config.hidden_size
-        self.mismatched_embedder = MisMatchedEmbedder(device, sub_token_mode)
+        self.mismatched_embedder = MisMatchedEmbedder(
+            device, sub_token_mode, max_span_width)
         self.activate_grad = True
 
     def forward(self, input_dict, requires_grad=True):
@@ -55,7 +56,8 @@ class GECToRModel(nn.Module):
                  detect_incorrect_id,
                  correct_keep_id,
                  sub_token_mode,
-                 device
+                 device,
+                 max_span_width=None
                  ):
 
         super().__init__()
@@ -66,7 +68,8 @@ class GECToRModel(nn.Module):
         self.num_detect_tags = num_detect_tags
         self.additional_confidence = additional_confidence
 
-        self.encoder = SeqEncoder(sub_token_mode, encoder_path, device)
+        self.encoder = SeqEncoder(
+            sub_token_mode, encoder_path, device, max_span_width)
         self.embedding_size = self.encoder.hidden_size
         self.detect_proj_layer = nn.Linear(
             self.embedding_size, num_detect_tags)
@@ -91,7 +94,7 @@ class GECToRModel(nn.Module):
         max_incorrect_probs = torch.max(detect_incorrect_probs, dim=-1).values
         if self.additional_confidence != 0:
             correct_probs_change = torch.zeros(
-                batch_size, seq_len, self.num_correct_tags, dtype=torch.float32).to(self.device)
+                batch_size, seq_len, self.num_correct_tags, dtype=torch.float32, device=correct_probs.device)
             correct_probs_change[:, :,
                                  self.correct_keep_id] = self.additional_confidence
             correct_probs += correct_probs_change
@@ -1,17 +1,40 @@
 # -*- coding:UTF-8 -*-
-import re
+import logging
+import numpy as np
 from transformers import AutoTokenizer
 from utils.mismatched_utils import *
 from src.dataset import Seq2EditVocab, MyCollate
 from utils.helpers import INCORRECT_LABEL, KEEP_LABEL, PAD_LABEL, START_TOKEN, UNK_LABEL, get_target_sent_by_edits
 from src.model import GECToRModel
 from random import seed
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 import deepspeed
 import os
 import torch
 from deepspeed.runtime.fp16.loss_scaler import DynamicLossScaler
 import torch.serialization
 
+_LOG = logging.getLogger(__name__)
+
+
+@contextmanager
+def _safe_globals(globs):
+    """
+    allow globs for weights_only torch.load within the context
+    """
+    if hasattr(torch.serialization, "safe_globals"):
+        with torch.serialization.safe_globals(globs):
+            yield
+        return
+    # Older PyTorch versions only have the global add_safe_globals, or nothing at all
+    try:
+        torch.serialization.add_safe_globals(globs)
+    except AttributeError:
+        pass
+    yield
+
+
 class Predictor:
     def __init__(self, args):
         self.fix_seed()
@@ -24,8 +47,15 @@ class Predictor:
         self.min_error_probability = args.min_error_probability
         self.max_pieces_per_token = args.max_pieces_per_token
         self.debug_force_edit = getattr(args, 'debug_force_edit', 0)
+        self.bucket_size = getattr(args, 'bucket_size', 32)
+        self.amp_dtype = {"fp16": torch.float16, "bf16": torch.bfloat16}.get(
+            getattr(args, 'amp_dtype', "fp32"))
+        if self.amp_dtype == torch.bfloat16 and torch.cuda.is_available() and not torch.cuda.is_bf16_supported():
+            _LOG.warning("bf16 is not supported on this device, fall back to fp16 autocast")
+            self.amp_dtype = torch.float16
         self.vocab = Seq2EditVocab(
             args.detect_vocab_path, args.correct_vocab_path, unk2keep=bool(args.unk2keep))
+        self.build_label_action_table()
         
         # DEBUG: Print vocabs
         print(f"DEBUG: Loaded detect vocab from {args.detect_vocab_path}")
@@ -70,9 +100,40 @@ class Predictor:
             max_len=self.max_num_tokens,
             input_pad_id=self.base_tokenizer.pad_token_id,
             detect_pad_id=self.vocab.detect_vocab["tag2id"][PAD_LABEL],
-            correct_pad_id=self.vocab.correct_vocab["tag2id"][PAD_LABEL])
+            correct_pad_id=self.vocab.correct_vocab["tag2id"][PAD_LABEL],
+            pad_to_longest=True)
+        # cuda graphs of the model forward, keyed by (padded batch size, padded seq len)
+        self.use_cuda_graph = bool(getattr(args, 'cuda_graph', 0)) and \
+            torch.device(self.device).type == "cuda"
         self.model = self.init_model(args)
         self.model.eval()
+        # reusable pinned host buffers for device-to-host copies of predictions
+        self._pinned = {}
+        # reusable pinned host / device buffers for model inputs, sized for a full bucket.
+        # keyed by (input key, slot), two slots so the next bucket can be copied while the current one is in use
+        self._host_bufs = {}
+        self._dev_bufs = {}
+        self._copy_stream = None
+        # per slot event recorded after its h2d copies, guards cpu writes into the slot's pinned buffers
+        self._copy_events = {}
+        if torch.device(self.device).type == "cuda":
+            # h2d copies of inputs run on a side stream to overlap with host work
+            self._copy_stream = torch.cuda.Stream()
+            max_numel = self.bucket_size * self.max_num_tokens
+            for slot in range(2):
+                for k in ["input_ids", "token_type_ids", "attention_mask", "word_mask", "offsets"]:
+                    # offsets are (start, end) pairs
+                    numel = max_numel * 2 if k == "offsets" else max_numel
+                    self._host_bufs[(k, slot)] = torch.empty(
+                        numel, dtype=torch.long, pin_memory=True)
+                    self._dev_bufs[(k, slot)] = torch.empty(
+                        numel, dtype=torch.long, device=self.device)
+        self._graphs = {}
+        self._static_inputs = {}
+        self._static_outputs = {}
+        self._graph_pool = None
+        # background worker to tokenize the next bucket while the current one runs on device
+        self._pool = ThreadPoolExecutor(max_workers=1)
 
     def init_model(self, args):
         model = GECToRModel(
@@ -86,71 +147,95 @@ class Predictor:
             detect_incorrect_id=self.vocab.detect_vocab["tag2id"][INCORRECT_LABEL],
             correct_keep_id=self.vocab.correct_vocab["tag2id"][KEEP_LABEL],
             sub_token_mode=args.sub_token_mode,
-            device=self.device
+            device=self.device,
+            # static span width keeps shapes capturable, otherwise use the max width in the batch
+            max_span_width=self.max_pieces_per_token if self.use_cuda_graph else None
         )
-        ds_engine, _, _, _ = deepspeed.initialize(
-            args=args, model=model, model_parameters=model.parameters())
-        
-        # Add DynamicLossScaler to the safe globals for PyTorch 2.6 compatibility
-        try:
-            torch.serialization.add_safe_globals([DynamicLossScaler])
-        except AttributeError:
-            # Older PyTorch versions don't have add_safe_globals
-            pass
-        
-        load_dir, tag = os.path.split(args.ckpt_path)
-        print(f"DEBUG: Loading checkpoint from directory: {load_dir}, tag: {tag}")
+        self.load_checkpoint(model, args.ckpt_path)
+        # inference engine without optimizer states, with fused transformer kernels if supported
+        ds_engine = deepspeed.init_inference(
+            model,
+            dtype=self.amp_dtype or torch.float32,
+            replace_with_kernel_inject=bool(getattr(args, 'kernel_inject', 1)))
+        return ds_engine
+
+    def load_checkpoint(self, model, ckpt_path):
+        """
+        load module weights from a deepspeed checkpoint dir, e.g. ckpts/globalstep-xxxx
+        """
+        model_states_path = os.path.join(ckpt_path, "mp_rank_00_model_states.pt")
+        _LOG.info("Loading checkpoint from: %s", model_states_path)
         try:
-            print("DEBUG: Attempting to load checkpoint with default settings")
-            ds_engine.load_checkpoint(load_dir=load_dir, tag=tag, load_module_only=True, load_optimizer_states=False, load_lr_scheduler_states=False)
-            print("DEBUG: Successfully loaded checkpoint")
+            # allow DynamicLossScaler for PyTorch 2.6+ weights_only loading, scoped to this call
+            with _safe_globals([DynamicLossScaler]):
+                model_states = torch.load(model_states_path, map_location="cpu")
         except Exception as e:
-            print(f"DEBUG: Error loading checkpoint: {str(e)}")
-            if "weights_only" in str(e):
-                # For PyTorch 2.6+, try loading with weights_only=False
-                print("Warning: Attempting to load checkpoint with weights_only=False due to PyTorch 2.6+ compatibility issues")
-                # We need to patch deepspeed's checkpoint loading to use weights_only=False
-                # This is a bit hacky but should work for compatibility
-                import types
-                from functools import partial
-                
-                original_torch_load = torch.load
-                # Monkey patch torch.load to use weights_only=False
-                torch.load = lambda *args, **kwargs: original_torch_load(*args, **kwargs, weights_only=False)
-                
-                try:
-                    ds_engine.load_checkpoint(load_dir=load_dir, tag=tag, load_module_only=True, load_optimizer_states=False, load_lr_scheduler_states=False)
-                    print("DEBUG: Successfully loaded checkpoint with weights_only=False")
-                finally:
-                    # Restore original torch.load
-                    torch.load = original_torch_load
-            else:
+            if "weights_only" not in str(e):
                 raise
-
-        return ds_engine
+            # the checkpoint may hold other non-tensor objects
+            _LOG.warning("Loading checkpoint with weights_only=False due to PyTorch 2.6+ compatibility issues")
+            model_states = torch.load(
+                model_states_path, map_location="cpu", weights_only=False)
+        model.load_state_dict(model_states["module"])
 
     def handle_batch(self, full_batch):
-        final_batch = full_batch[:]
-        # {sent idx: sent}, used for stop iter early
-        prev_preds_dict = {idx: [sent] for idx, sent in enumerate(final_batch)}
-        short_skip_id_set = set([idx for idx, sent in enumerate(
-            final_batch) if len(sent) < self.min_seq_len])
-        # idxs for len(sent) > min_seq_len
-        pred_ids = [idx for idx in range(
-            len(full_batch)) if idx not in short_skip_id_set]
+        # shallow copy, sents are replaced but never modified in place
+        final_batch = list(full_batch)
+        # {sent idx: set of seen sents as tuples}, used for stop iter early
+        prev_preds_dict = {}
+        # idxs for len(sent) >= min_seq_len
+        pred_ids = []
+        min_seq_len = self.min_seq_len
+        for idx, sent in enumerate(full_batch):
+            prev_preds_dict[idx] = {tuple(sent)}
+            if len(sent) >= min_seq_len:
+                pred_ids.append(idx)
         total_updates = 0
 
         for n_iter in range(self.iteration_count):
-            ori_batch = [final_batch[i] for i in pred_ids]
-            batch_input_dict, truncated_seq_lengths = self.preprocess(ori_batch)
-            if not batch_input_dict:
-                break
-            label_probs, label_ids, max_detect_incor_probs = self.predict(
-                batch_input_dict)
-            del batch_input_dict
-            # list of sents(each sent is a list of target tokens)
-            pred_batch = self.postprocess(
-                ori_batch, truncated_seq_lengths, label_probs, label_ids, max_detect_incor_probs)
+            # sort by length and predict in buckets, so that sents in a bucket need little padding
+            pred_ids = sorted(pred_ids, key=lambda idx: len(final_batch[idx]))
+            # list of sents(each sent is a list of target tokens), aligned with pred_ids
+            pred_batch = []
+            buckets = [[final_batch[i] for i in pred_ids[start:start+self.bucket_size]]
+                       for start in range(0, len(pred_ids), self.bucket_size)]
+            next_encoded = self._pool.submit(self.tokenize_batch, buckets[0]) if buckets else None
+            next_inputs = None
+            for bucket_idx, ori_batch in enumerate(buckets):
+                if next_inputs is None:
+                    next_inputs = self.to_device(
+                        next_encoded.result(), slot=bucket_idx % 2)
+                batch_input_dict, next_inputs = next_inputs, None
+                has_next = bucket_idx + 1 < len(buckets)
+                if has_next:
+                    next_encoded = self._pool.submit(
+                        self.tokenize_batch, buckets[bucket_idx + 1])
+                if not batch_input_dict:
+                    pred_batch.extend(ori_batch)
+                    continue
+                batch_candidates, max_detect_incor_probs = self.predict(
+                    batch_input_dict)
+                del batch_input_dict
+                # start copying the next bucket to device while this one is postprocessed
+                if has_next:
+                    next_inputs = self.to_device(
+                        next_encoded.result(), slot=(bucket_idx + 1) % 2)
+                # sents whose max error prob is below threshold are converged, keep them as is
+                # and only postprocess the rest. they drop out of pred_ids as they're unchanged.
+                active = [i for i, incor_prob in enumerate(max_detect_incor_probs)
+                          if incor_prob >= self.min_error_probability]
+                if len(active) < len(ori_batch):
+                    bucket_preds = list(ori_batch)
+                    active_preds = self.postprocess(
+                        [ori_batch[i] for i in active],
+                        [batch_candidates[i] for i in active],
+                        [max_detect_incor_probs[i] for i in active])
+                    for i, pred in zip(active, active_preds):
+                        bucket_preds[i] = pred
+                else:
+                    bucket_preds = self.postprocess(
+                        ori_batch, batch_candidates, max_detect_incor_probs)
+                pred_batch.extend(bucket_preds)
 
             final_batch, pred_ids, cnt = \
                 self.update_final_batch(final_batch, pred_ids, pred_batch,
@@ -161,113 +246,224 @@ class Predictor:
         return final_batch, total_updates
 
     def predict(self, batch_inputs):
+        if self._copy_stream is not None:
+            # inputs are copied on the side stream by to_device
+            torch.cuda.current_stream().wait_stream(self._copy_stream)
         with torch.no_grad():
-            for k, v in batch_inputs.items():
-                batch_inputs[k] = v.cuda()
-            outputs = self.model(batch_inputs)
+            if self.use_cuda_graph:
+                outputs = self.graph_forward(batch_inputs)
+            else:
+                outputs = self.model_forward(batch_inputs)
+        # keep argmax and thresholds in fp32
         label_probs, label_ids = torch.max(
-            outputs['class_probabilities_labels'], dim=-1)
-        max_detect_incor_probs = outputs['max_error_probability']
-        return label_probs.tolist(), label_ids.tolist(), max_detect_incor_probs.tolist()
-
-    def preprocess(self, seqs):
-        seq_lens = [len(seq) for seq in seqs if seq]
-        if not seq_lens:
-            return []
+            outputs['class_probabilities_labels'].float(), dim=-1)
+        max_detect_incor_probs = outputs['max_error_probability'].float()
+        # only words with a non-$KEEP label above threshold can produce an edit,
+        # thus we filter them on device and only transfer the candidates.
+        candidate_mask = (label_ids != self.vocab.correct_vocab["tag2id"][KEEP_LABEL]) & \
+            (label_probs >= self.min_error_probability) & batch_inputs["word_mask"].bool()
+        sent_idxs, pos_idxs = candidate_mask.nonzero(as_tuple=True)
+        candidate_probs = label_probs[sent_idxs, pos_idxs]
+        candidate_ids = label_ids[sent_idxs, pos_idxs]
+        if label_probs.is_cuda:
+            # nonzero above already blocked to read the candidate count, this is the second sync:
+            # stage the outputs with async copies and wait for them once
+            sent_idxs = self.copy_to_pinned("sent_idxs", sent_idxs)
+            pos_idxs = self.copy_to_pinned("pos_idxs", pos_idxs)
+            candidate_probs = self.copy_to_pinned("probs", candidate_probs)
+            candidate_ids = self.copy_to_pinned("ids", candidate_ids)
+            max_detect_incor_probs = self.copy_to_pinned(
+                "incor", max_detect_incor_probs)
+            torch.cuda.current_stream().synchronize()
+        # per sent list of (word idx, label prob, label id), ordered by word idx
+        batch_candidates = [[] for _ in range(len(max_detect_incor_probs))]
+        for sent_idx, pos_idx, label_prob, label_id in zip(sent_idxs.tolist(), pos_idxs.tolist(),
+                                                           candidate_probs.tolist(), candidate_ids.tolist()):
+            batch_candidates[sent_idx].append((pos_idx, label_prob, label_id))
+        return batch_candidates, max_detect_incor_probs.tolist()
+
+    def model_forward(self, batch_inputs):
+        # autocast weight cache must be disabled when capturing cuda graphs
+        with torch.autocast(device_type="cuda", dtype=self.amp_dtype, enabled=self.amp_dtype is not None,
+                            cache_enabled=not self.use_cuda_graph):
+            return self.model(batch_inputs)
+
+    def graph_forward(self, batch_inputs):
+        """
+        pad inputs to a captured (batch size, seq len) shape, replay the graph and slice the outputs back.
+        batch size and seq len are padded to the next power of 2, capped at bucket_size / max_num_tokens.
+        """
+        batch_size, seq_len = batch_inputs["input_ids"].shape
+        padded_batch_size = min(1 << (batch_size - 1).bit_length(), self.bucket_size)
+        padded_seq_len = min(1 << (seq_len - 1).bit_length(), self.max_num_tokens)
+        key = (max(padded_batch_size, batch_size), max(padded_seq_len, seq_len))
+        if key not in self._graphs:
+            self.capture_graph(key)
+        static_inputs = self._static_inputs[key]
+        for k, v in static_inputs.items():
+            if k == "input_ids":
+                v.fill_(self.base_tokenizer.pad_token_id)
+            else:
+                v.zero_()
+            v[:batch_size, :seq_len].copy_(batch_inputs[k])
+        self._graphs[key].replay()
+        static_outputs = self._static_outputs[key]
+        return {
+            "class_probabilities_labels": static_outputs["class_probabilities_labels"][:batch_size, :seq_len],
+            "max_error_probability": static_outputs["max_error_probability"][:batch_size]}
+
+    def capture_graph(self, key):
+        batch_size, seq_len = key
+        static_inputs = {
+            k: torch.zeros(batch_size, seq_len, dtype=torch.long, device=self.device)
+            for k in ["input_ids", "token_type_ids", "attention_mask", "word_mask"]}
+        static_inputs["input_ids"].fill_(self.base_tokenizer.pad_token_id)
+        static_inputs["offsets"] = torch.zeros(
+            batch_size, seq_len, 2, dtype=torch.long, device=self.device)
+        if self._graph_pool is None:
+            self._graph_pool = torch.cuda.graph_pool_handle()
+
+        # warmup on a side stream before capture
+        side_stream = torch.cuda.Stream()
+        side_stream.wait_stream(torch.cuda.current_stream())
+        with torch.cuda.stream(side_stream):
+            for _ in range(3):
+                self.model_forward(static_inputs)
+        torch.cuda.current_stream().wait_stream(side_stream)
+
+        graph = torch.cuda.CUDAGraph()
+        with torch.cuda.graph(graph, pool=self._graph_pool):
+            outputs = self.model_forward(static_inputs)
+        self._graphs[key] = graph
+        self._static_inputs[key] = static_inputs
+        self._static_outputs[key] = {
+            "class_probabilities_labels": outputs["class_probabilities_labels"],
+            "max_error_probability": outputs["max_error_probability"]}
+
+    def copy_to_pinned(self, name, tensor):
+        """
+        copy a device tensor into a reusable pinned host buffer, non-blocking.
+        """
+        host_tensor = self.get_buffer(self._pinned, name, tensor, pin_memory=True)
+        host_tensor.copy_(tensor, non_blocking=True)
+        return host_tensor
+
+    def get_buffer(self, bufs, name, like, **alloc_kwargs):
+        """
+        return a contiguous view with the shape and dtype of `like` on a reusable flat buffer.
+        the buffer is reallocated only when a larger tensor comes in.
+        """
+        numel = like.numel()
+        buf = bufs.get(name)
+        if buf is None or buf.dtype != like.dtype or buf.numel() < numel:
+            buf = torch.empty(numel, dtype=like.dtype, **alloc_kwargs)
+            bufs[name] = buf
+        return buf[:numel].view(like.shape)
+
+    def tokenize_batch(self, seqs):
+        """
+        tokenize and collate seqs into host tensors, to_device moves them to the device
+        """
+        if not any(seqs):
+            return {}
         input_dict_batch = []
-        truncated_seq_lengths = []
-        for words in seqs:
-            words = [START_TOKEN] + words
-            input_ids, offsets, truncated_seq_length = self.mismatched_tokenizer.encode(words, add_special_tokens=False, max_tokens=self.max_num_tokens)
-            words = words[:truncated_seq_length]
-            truncated_seq_lengths.append(truncated_seq_length)
-            input_dict = self.build_input_dict(input_ids, offsets, len(words))
+        encoded_batch = self.mismatched_tokenizer.encode_batch(
+            [[START_TOKEN] + words for words in seqs], add_special_tokens=False, max_tokens=self.max_num_tokens)
+        for input_ids, offsets, truncated_seq_length in encoded_batch:
+            input_dict = self.build_input_dict(input_ids, offsets, truncated_seq_length)
             input_dict_batch.append(input_dict)
-        batch_input_dict = self.collate_fn(input_dict_batch)
+        return self.collate_fn(input_dict_batch)
+
+    def to_device(self, batch_input_dict, slot=0):
+        """
+        on cuda, stage inputs through pinned memory into the device buffers of `slot`,
+        with non-blocking copies on the copy stream. predict waits for the copies.
+        """
+        if self._copy_stream is None:
+            for k, v in batch_input_dict.items():
+                batch_input_dict[k] = v.to(self.device)
+            return batch_input_dict
+        # the slot's pinned host buffers may still be read by its previous non-blocking copies
+        if slot in self._copy_events:
+            self._copy_events[slot].synchronize()
+        # the slot's device buffers may still be read or written by work on the compute stream
+        self._copy_stream.wait_stream(torch.cuda.current_stream())
         for k, v in batch_input_dict.items():
-            batch_input_dict[k] = v.to(self.device)
-        return batch_input_dict, truncated_seq_lengths
-
-    def postprocess(self, batch, truncated_seq_lengths, batch_label_probs, batch_label_ids, batch_incor_probs):
-        keep_id = self.vocab.correct_vocab["tag2id"][KEEP_LABEL]
-        all_results = []
-        for tokens, truncated_seq_length, label_probs, label_ids, incor_prob in zip(batch, truncated_seq_lengths, batch_label_probs,
-                                                              batch_label_ids, batch_incor_probs):
+            # buffers are (re)allocated outside of the copy stream
+            host_tensor = self.get_buffer(
+                self._host_bufs, (k, slot), v, pin_memory=True)
+            host_tensor.copy_(v)
+            dev_tensor = self.get_buffer(
+                self._dev_bufs, (k, slot), v, device=self.device)
+            with torch.cuda.stream(self._copy_stream):
+                dev_tensor.copy_(host_tensor, non_blocking=True)
+            batch_input_dict[k] = dev_tensor
+        copy_event = self._copy_events.setdefault(slot, torch.cuda.Event())
+        copy_event.record(self._copy_stream)
+        return batch_input_dict
+
+    def postprocess(self, batch, batch_candidates, batch_incor_probs):
+        """
+        batch_candidates: per sent list of (word idx, label prob, label id) from predict,
+        only for words with a non-$KEEP label above threshold.
+        """
+        # hoist attribute lookups out of the per-sentence / per-token loops
+        min_prob = self.min_error_probability
+        debug_force = bool(self.debug_force_edit)
+        get_label_action = self.get_label_action
+        debug = _LOG.isEnabledFor(logging.DEBUG)
+        # unchanged sents are the input lists themselves
+        all_results = list(batch)
+        for sent_idx, (tokens, candidates, incor_prob) in enumerate(zip(batch, batch_candidates, batch_incor_probs)):
             # since we add special tokens before truncation, max_len should minus 1. This is different from original gector.
             edits = []
 
-            # DEBUG: Print prediction details
-            sent = " ".join(tokens)
-            if len(sent) > 50:
-                sent = sent[:50] + "..."
-            print(f"DEBUG: Processing: {sent}")
-            print(f"DEBUG: max_label_id={max(label_ids)}, keep_id={keep_id}, is_all_keep={max(label_ids) == keep_id}")
-            print(f"DEBUG: max_incor_prob={incor_prob}, min_threshold={self.min_error_probability}")
-            
-            # Print all labels and their IDs for analysis
-            id_to_tag = self.vocab.correct_vocab["id2tag"]
-            print(f"DEBUG: Label ID mapping:")
-            for i, label_id in enumerate(label_ids):
-                if i < len(tokens):
-                    token = tokens[i] if i > 0 else START_TOKEN
-                    label = id_to_tag[label_id]
-                    print(f"  Token: '{token}', Label ID: {label_id}, Label: '{label}'")
-            
+            if debug:
+                sent = " ".join(tokens)
+                if len(sent) > 50:
+                    sent = sent[:50] + "..."
+                _LOG.debug("Processing: %s", sent)
+                _LOG.debug("num_candidates=%s, max_incor_prob=%s, min_threshold=%s",
+                           len(candidates), incor_prob, min_prob)
+
             # Force an edit to verify edit application works if debug flag is set
-            if bool(self.debug_force_edit) and len(tokens) > 3:
-                print("DEBUG: Forcing test edits to verify edit application works")
+            if debug_force and len(tokens) > 3:
                 # Add a replacement edit for every 3rd token
                 for i in range(2, min(len(tokens), 10), 3):  # Limit to first 10 tokens
                     forced_edit = (i, i+1, f"FORCED_EDIT_{i}", 1.0)
                     edits.append(forced_edit)
-                    print(f"DEBUG: Added forced edit: {forced_edit} for token '{tokens[i]}'")
-            
-            # skip the whole sent if all labels are $KEEP and not in debug mode
-            if max(label_ids) == keep_id and not bool(self.debug_force_edit):
-                print("DEBUG: Skipping - all labels are KEEP")
-                all_results.append(tokens)
+                    if debug:
+                        _LOG.debug("Added forced edit: %s for token '%s'", forced_edit, tokens[i])
+
+            # skip the whole sent if there are no edit candidates and not in debug mode
+            if not candidates and not debug_force:
                 continue
 
             # if max detect_incor_probs < min_error_prob, skip
-            if incor_prob < self.min_error_probability:
-                print("DEBUG: Skipping - max error probability below threshold")
-                all_results.append(tokens)
+            if incor_prob < min_prob:
                 continue
 
-            for idx in range(truncated_seq_length):
+            for idx, label_prob, label_id in candidates:
                 if idx == 0:
                     token = START_TOKEN
                 else:
                     # tokens in ori_batch don't have "$START" token, thus offset = 1
                     token = tokens[idx-1]
-                if label_ids[idx] == keep_id:
-                    continue
                 # prediction for \s matched token is $keep, for spellcheck task.
-                if re.search("\s+", token):
+                if any(map(str.isspace, token)):
                     continue
-                label = self.vocab.correct_vocab["id2tag"][label_ids[idx]]
-                # Debug label detection
-                print(f"DEBUG: Found non-$KEEP label at pos {idx}: '{label}' for token '{token}' with prob {label_probs[idx]}")
-                
-                action = self.get_label_action(
-                    token, idx, label_probs[idx], label)
+                action = get_label_action(idx, label_prob, label_id)
 
                 if not action:
-                    print(f"DEBUG: Action discarded - label '{label}' prob {label_probs[idx]} < {self.min_error_probability} or special label")
                     continue
-                
-                print(f"DEBUG: Adding edit: {action} for token '{token}'")
+                if debug:
+                    _LOG.debug("Adding edit: %s for token '%s'", action, token)
                 edits.append(action)
-            # Debug final edits
-            print(f"DEBUG: Final edits for sentence: {edits}")
             if edits:
-                print(f"DEBUG: Original text: '{' '.join(tokens)}'")
                 result = get_target_sent_by_edits(tokens, edits)
-                print(f"DEBUG: Edited text: '{' '.join(result)}'")
-                all_results.append(result)
-            else:
-                print("DEBUG: No edits applied, keeping original")
-                all_results.append(tokens)
+                if debug:
+                    _LOG.debug("Edited text: '%s'", " ".join(result))
+                all_results[sent_idx] = result
         return all_results
 
     def update_final_batch(self, final_batch, pred_ids, pred_batch,
@@ -281,65 +477,74 @@ class Predictor:
             pred_tokens = pred_batch[i]
             prev_preds = prev_preds_dict[ori_id]
 
-            if ori_tokens != pred_tokens:
-                if pred_tokens not in prev_preds:
-                    final_batch[ori_id] = pred_tokens
-                    new_pred_ids.append(ori_id)
-                    prev_preds_dict[ori_id].append(pred_tokens)
-                else:
-                    final_batch[ori_id] = pred_tokens
-                total_updated += 1
-            else:
+            # postprocess returns the input list itself when nothing is edited
+            if pred_tokens is ori_tokens or ori_tokens == pred_tokens:
                 continue
+            pred_key = tuple(pred_tokens)
+            if pred_key not in prev_preds:
+                final_batch[ori_id] = pred_tokens
+                new_pred_ids.append(ori_id)
+                prev_preds.add(pred_key)
+            else:
+                final_batch[ori_id] = pred_tokens
+            total_updated += 1
         return final_batch, new_pred_ids, total_updated
 
-    def get_label_action(self, token: str, idx: int, label_prob: float, label: str):
-        # Debug label action generation
-        print(f"DEBUG: get_label_action for token='{token}', label='{label}', prob={label_prob}")
-        
+    def build_label_action_table(self):
+        """
+        classify every correction tag once, so that get_label_action is a table lookup.
+        action kind: 0 -> no edit, 1 -> replace/transform/delete, 2 -> append/merge
+        """
+        id2tag = self.vocab.correct_vocab["id2tag"]
+        self._action_kind = np.zeros(len(id2tag), dtype=np.int8)
+        self._processed_label = [""] * len(id2tag)
+        for label_id, label in enumerate(id2tag):
+            if label in [UNK_LABEL, PAD_LABEL, KEEP_LABEL]:
+                continue
+            if label.startswith("$REPLACE_") or label.startswith("$TRANSFORM_") or label == "$DELETE":
+                self._action_kind[label_id] = 1
+            elif label.startswith("$APPEND_") or label.startswith("$MERGE_"):
+                self._action_kind[label_id] = 2
+            else:
+                _LOG.warning("Unknown label format: %s", label)
+                continue
+
+            if label == "$DELETE":
+                processed_label = ""
+            elif label.startswith("$TRANSFORM_") or label.startswith("$MERGE_"):
+                processed_label = label[:]
+            else:
+                processed_label = label[label.index("_")+1:]
+            self._processed_label[label_id] = processed_label
+
+    def get_label_action(self, idx: int, label_prob: float, label_id: int):
         if label_prob < self.min_error_probability:
-            print(f"DEBUG: Rejecting - probability {label_prob} < threshold {self.min_error_probability}")
             return None
-        
-        if label in [UNK_LABEL, PAD_LABEL, KEEP_LABEL]:
-            print(f"DEBUG: Rejecting - special label {label}")
+        kind = self._action_kind[label_id]
+        if kind == 0:
             return None
-
-        if label.startswith("$REPLACE_") or label.startswith("$TRANSFORM_") or label == "$DELETE":
-            start_pos = idx
-            end_pos = idx + 1
-        elif label.startswith("$APPEND_") or label.startswith("$MERGE_"):
-            start_pos = idx + 1
-            end_pos = idx + 1
-        else:
-            print(f"DEBUG: Unknown label format: {label}")
-
-        if label == "$DELETE":
-            processed_label = ""
-        elif label.startswith("$TRANSFORM_") or label.startswith("$MERGE_"):
-            processed_label = label[:]
-        else:
-            processed_label = label[label.index("_")+1:]
-            
-        action = (start_pos - 1, end_pos - 1, processed_label, label_prob)
-        print(f"DEBUG: Created action: {action}")
-        return action
+        # idx counts the $START token, thus edit positions are shifted by -1
+        if kind == 1:
+            return (idx - 1, idx, self._processed_label[label_id], label_prob)
+        return (idx, idx, self._processed_label[label_id], label_prob)
 
     def build_input_dict(self, input_ids, offsets, word_level_len):
-        token_type_ids = [0 for _ in range(len(input_ids))]
-        attn_mask = [1 for _ in range(len(input_ids))]
-        word_mask = [1 for _ in range(word_level_len)]
+        input_len = len(input_ids)
         input_dict = {
-            "input_ids": input_ids,
-            "token_type_ids": token_type_ids,
-            "attention_mask": attn_mask,
-            "offsets": offsets,
-            "word_mask": word_mask}
+            "input_ids": np.asarray(input_ids, dtype=np.int64),
+            "token_type_ids": np.zeros(input_len, dtype=np.int64),
+            "attention_mask": np.ones(input_len, dtype=np.int64),
+            "offsets": np.asarray(offsets, dtype=np.int64).reshape(-1, 2),
+            "word_mask": np.ones(word_level_len, dtype=np.int64)}
         return input_dict
 
     def fix_seed(self):
         torch.manual_seed(1)
         torch.backends.cudnn.enabled = True
+        # inference only: let cudnn pick the fastest kernels instead of deterministic ones
         torch.backends.cudnn.benchmark = True
-        torch.backends.cudnn.deterministic = True
+        torch.backends.cudnn.deterministic = False
+        # allow tf32 matmul / conv on ampere+ gpus
+        torch.backends.cuda.matmul.allow_tf32 = True
+        torch.backends.cudnn.allow_tf32 = True
         seed(43)
@@ -12,22 +12,48 @@ class MisMatchedTokenizer:
         self.special_start_token_ids = special_start_token_ids
 
     def encode(self, words: list, add_special_tokens=False, max_tokens=None):
+        # lazily tokenize, words after the truncation point are never tokenized
+        wordpiece_ids_list = (self._convert_to_ids(
+            self.tokenizer.tokenize(word)) for word in words)
+        return self._pack(wordpiece_ids_list, add_special_tokens, max_tokens)
+
+    def encode_batch(self, batch_words: list, add_special_tokens=False, max_tokens=None):
+        """
+        same as calling encode on every sent, but each distinct word in the batch is tokenized once
+        and fast tokenizers tokenize them in a single batched call.
+        """
+        uniq_words = list({word: None for words in batch_words for word in words})
+        if getattr(self.tokenizer, "is_fast", False) and uniq_words:
+            encodings = self.tokenizer(uniq_words, add_special_tokens=False)
+            wordpieces_list = [encodings.tokens(i)
+                               for i in range(len(uniq_words))]
+        else:
+            wordpieces_list = [self.tokenizer.tokenize(
+                word) for word in uniq_words]
+        word2ids = {word: self._convert_to_ids(wordpieces)
+                    for word, wordpieces in zip(uniq_words, wordpieces_list)}
+        return [self._pack([word2ids[word] for word in words], add_special_tokens, max_tokens)
+                for words in batch_words]
+
+    def _convert_to_ids(self, wordpieces):
+        wordpiece_ids = [self.tokenizer_vocab[wordpiece]
+                         for wordpiece in wordpieces]
+        # we set ovv token's wordpiece id to unk_token_id,
+        # thus we can deal with it as normal tokens
+        if not len(wordpiece_ids):
+            wordpiece_ids = [self.tokenizer.unk_token_id]
+        elif (self.max_pieces_per_token is not None):
+            wordpiece_ids = wordpiece_ids[:self.max_pieces_per_token]
+        return wordpiece_ids
+
+    def _pack(self, wordpiece_ids_list, add_special_tokens=False, max_tokens=None):
         truncated_seq_length = 0
         input_ids = []
         offsets = []
         num_tokens = 0
         if max_tokens and add_special_tokens:
             max_tokens -= len(self.special_start_token_ids)
-        for word in words:
-            wordpieces = self.tokenizer.tokenize(word)
-            wordpiece_ids = [self.tokenizer_vocab[wordpiece]
-                             for wordpiece in wordpieces]
-            # we set ovv token's wordpiece id to unk_token_id,
-            # thus we can deal with it as normal tokens
-            if not len(wordpiece_ids):
-                wordpiece_ids = [self.tokenizer.unk_token_id]
-            elif (self.max_pieces_per_token is not None):
-                wordpiece_ids = wordpiece_ids[:self.max_pieces_per_token]
+        for wordpiece_ids in wordpiece_ids_list:
             num_tokens += len(wordpiece_ids)
             if max_tokens and num_tokens > max_tokens:
                 break
@@ -67,9 +93,12 @@ class MisMatchedSampleIndexer:
 
 
 class MisMatchedEmbedder:
-    def __init__(self, device, sub_token_mode):
+    def __init__(self, device, sub_token_mode, max_span_width=None):
         self.device = device
         self.sub_token_mode = sub_token_mode
+        # if set, spans are selected with this static width instead of the max width in the batch,
+        # which avoids a device sync and keeps shapes static (e.g. for cuda graphs)
+        self.max_span_width = max_span_width
 
     # build span embeddings
     def _batched_index_select(self, wordpiece_embeddings, span_indices):
@@ -95,7 +124,7 @@ class MisMatchedEmbedder:
     def _flatten_and_batch_shift_indices(self, span_indices, seq_len):
         # [0,bsz*seq_len], shape: (bsz,)
         offsets = torch.arange(span_indices.size(
-            0), dtype=torch.long).to(self.device) * seq_len
+            0), dtype=torch.long, device=span_indices.device) * seq_len
         # shape: (bsz, 1, 1)
         # this operation maps the dim of span_indices
         for _ in range(len(span_indices.size())-1):
@@ -131,8 +160,12 @@ class MisMatchedEmbedder:
         # Thus, here we +1 to get the actual max_batch_span_width
         # span_widths.max().item() + 1
         # (1, 1, max_batch_span_width)
-        max_span_range_indices = torch.arange(0, span_widths.max(
-        ).item() + 1, dtype=torch.long).to(self.device).view(1, 1, -1)
+        if self.max_span_width is not None:
+            max_batch_span_width = self.max_span_width
+        else:
+            max_batch_span_width = span_widths.max().item() + 1
+        max_span_range_indices = torch.arange(
+            0, max_batch_span_width, dtype=torch.long, device=offset_spans.device).view(1, 1, -1)
 
         # we create a range vector of size max_span_width, and mask walues
         # which are greater than the actual length of the span